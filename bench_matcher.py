@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import multiprocessing
+import random
+import statistics
+import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+import matcher
+from matcher import MatchResult, MessageInput
+
+CHAT_ID = -1001954706166
+LAG_SAMPLE_SECONDS = 0.005
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Задержка event loop при проверке правил в loop и в пуле процессов"
+    )
+    parser.add_argument("--rate", type=int, default=500, help="Сообщений в секунду")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Длительность прогона")
+    parser.add_argument("--batch-size", type=int, default=50, help="Размер пачки (как POLL_LIMIT)")
+    parser.add_argument("--processes", type=int, default=4, help="Процессов в пуле")
+    parser.add_argument("--rules", type=int, default=10, help="Количество конфигов")
+    parser.add_argument("--words", type=int, default=500, help="Слов-исключений в каждом конфиге")
+    return parser.parse_args()
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase + "абвгдежзиклмнопрст", k=rng.randint(4, 10)))
+
+
+def build_configs(rules: int, words: int, rng: random.Random) -> list[dict[str, Any]]:
+    return [
+        {
+            "chats": {CHAT_ID},
+            "keywords": [random_word(rng) for _ in range(50)] + ["ищу"],
+            "excluded_keywords": [random_word(rng) for _ in range(words)],
+            "excluded_senders": [],
+            "recipient": 1,
+            "include_questions": True,
+        }
+        for _ in range(rules)
+    ]
+
+
+def build_messages(count: int, rng: random.Random) -> list[MessageInput]:
+    return [
+        (
+            CHAT_ID,
+            rng.randint(1, 10_000),
+            " ".join(random_word(rng) for _ in range(rng.randint(5, 60))) + " ищу (трансфер)?",
+        )
+        for _ in range(count)
+    ]
+
+
+async def sample_lag(stop: asyncio.Event, samples: list[float]) -> None:
+    loop = asyncio.get_running_loop()
+
+    while not stop.is_set():
+        expected = loop.time() + LAG_SAMPLE_SECONDS
+        await asyncio.sleep(LAG_SAMPLE_SECONDS)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def run(
+    args: argparse.Namespace,
+    rules: list[matcher.CompiledRule],
+    messages: list[MessageInput],
+    pool: Optional[ProcessPoolExecutor],
+) -> tuple[list[float], float]:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    samples: list[float] = []
+    sampler = asyncio.create_task(sample_lag(stop, samples))
+
+    batch_interval = args.batch_size / args.rate
+    started_at = time.perf_counter()
+    processed = 0
+    pending: list[asyncio.Future[list[MatchResult]]] = []
+
+    for i in range(0, len(messages), args.batch_size):
+        batch = messages[i:i + args.batch_size]
+
+        if pool is None:
+            [matcher.evaluate_message(rules, *item) for item in batch]
+            processed += len(batch)
+        else:
+            pending.append(loop.run_in_executor(pool, matcher.evaluate_batch, batch))
+
+        delay = started_at + (i // args.batch_size + 1) * batch_interval - time.perf_counter()
+        await asyncio.sleep(max(0.0, delay))
+
+    for results in await asyncio.gather(*pending):
+        processed += len(results)
+
+    elapsed = time.perf_counter() - started_at
+
+    stop.set()
+    await sampler
+
+    return samples, processed / elapsed
+
+
+def report(name: str, samples: list[float], throughput: float) -> None:
+    ms = sorted(x * 1000 for x in samples)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+
+    print(
+        f"{name:8} lag p50={statistics.median(ms):7.2f}ms p99={p99:7.2f}ms max={ms[-1]:7.2f}ms "
+        f"throughput={throughput:8.0f} msg/s"
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    rng = random.Random(42)
+
+    configs = build_configs(args.rules, args.words, rng)
+    messages = build_messages(int(args.rate * args.seconds), rng)
+    rules = matcher.compile_rules(configs)
+
+    print(
+        f"rate={args.rate} msg/s seconds={args.seconds} batch={args.batch_size} "
+        f"rules={args.rules} words={args.words} processes={args.processes}"
+    )
+
+    samples, throughput = asyncio.run(run(args, rules, messages, None))
+    report("inline", samples, throughput)
+
+    with ProcessPoolExecutor(
+        max_workers=args.processes,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=matcher.init_worker,
+        initargs=(configs,),
+    ) as pool:
+        for _ in range(args.processes):
+            pool.submit(matcher.warm_up).result()
+
+        samples, throughput = asyncio.run(run(args, rules, messages, pool))
+        report("pool", samples, throughput)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
+import argparse
+import json
 import os
+import re
+from datetime import datetime, timezone
 from telethon import TelegramClient
+from telethon.tl.custom import Dialog
 from dotenv import load_dotenv
+from typing import Optional
 
 load_dotenv()
 
@@ -9,18 +15,121 @@ if api_id_str is None:
     raise ValueError("API_ID not set")
 api_id = int(api_id_str)
 api_hash = os.getenv("API_HASH")
-session_name = 'list_chats'
 
-client = TelegramClient(session_name, api_id, api_hash)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHAT_CACHE_PATH = os.getenv("CHAT_CACHE_PATH", os.path.join(BASE_DIR, "chat_cache.json"))
 
+DIALOG_TYPES = ("user", "group", "channel")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Выгрузка диалогов в кэш чатов для бота и черновик правил"
+    )
+    parser.add_argument(
+        "--session",
+        default="list_chats",
+        help="Сессия Telethon. access_hash в кэше действителен только для этого аккаунта",
+    )
+    parser.add_argument("--out", default=CHAT_CACHE_PATH, help="Куда записать кэш чатов")
+    parser.add_argument(
+        "--type",
+        dest="types",
+        action="append",
+        choices=DIALOG_TYPES,
+        help="Оставить только диалоги этого типа (можно указать несколько раз)",
+    )
+    parser.add_argument("--title", help="Регулярное выражение для названия диалога")
+    parser.add_argument("--rules-out", help="Записать черновик правил для CONFIGS")
+    parser.add_argument("--print", dest="print_dialogs", action="store_true", help="Печатать диалоги")
+    return parser.parse_args()
+
+
+def get_dialog_type(dialog: Dialog) -> str:
+    if dialog.is_group:
+        return "group"
+    if dialog.is_channel:
+        return "channel"
+    return "user"
+
+
+def dialog_matches(dialog: Dialog, types: Optional[list[str]], title_re: Optional[re.Pattern]) -> bool:
+    if types and get_dialog_type(dialog) not in types:
+        return False
+
+    if title_re is not None and not title_re.search(dialog.name or ""):
+        return False
+
+    return True
+
+
+def write_json(path: str, data: dict) -> None:
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    os.replace(tmp_path, path)
+
+
+def write_rules_draft(path: str, chats: dict[int, dict]) -> None:
+    lines = ["{", '    "name": "",', '    "chats": {']
+
+    for chat_id, item in chats.items():
+        lines.append(f"        {chat_id},  # {item['title']}")
+
+    lines += [
+        "    },",
+        '    "keywords": [],',
+        '    "excluded_keywords": [],',
+        '    "excluded_senders": [],',
+        '    "recipient": None,',
+        '    "include_questions": False,',
+        "},",
+        "",
+    ]
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+async def export_chats(client: TelegramClient, args: argparse.Namespace) -> None:
+    title_re = re.compile(args.title, re.IGNORECASE) if args.title else None
+    me = await client.get_me()
+    chats: dict[int, dict] = {}
 
-async def list_chats() -> None:
     async for dialog in client.iter_dialogs():
-        print(f"Title: {dialog.name}")
-        print(f"Chat ID: {dialog.id}")
-        print(f"Is Group: {dialog.is_group}")
-        print(f"Username: {getattr(dialog.entity, 'username', None)}")
-        print("------")
-
-with client:
-    client.loop.run_until_complete(list_chats())
+        if not dialog_matches(dialog, args.types, title_re):
+            continue
+
+        username = getattr(dialog.entity, "username", None)
+
+        chats[dialog.id] = {
+            "title": dialog.name,
+            "username": username,
+            "type": get_dialog_type(dialog),
+            "access_hash": getattr(dialog.entity, "access_hash", None),
+            "resolved_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+        if args.print_dialogs:
+            print(f"Title: {dialog.name}")
+            print(f"Chat ID: {dialog.id}")
+            print(f"Is Group: {dialog.is_group}")
+            print(f"Username: {username}")
+            print("------")
+
+    write_json(args.out, {"account_id": me.id, "chats": {str(k): v for k, v in chats.items()}})
+    print(f"Exported {len(chats)} dialogs to {args.out}")
+
+    if args.rules_out:
+        write_rules_draft(args.rules_out, chats)
+        print(f"Rules draft written to {args.rules_out}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client = TelegramClient(args.session, api_id, api_hash)
+
+    with client:
+        client.loop.run_until_complete(export_chats(client, args))
@@ -0,0 +1,107 @@
+import re
+from typing import Any, NamedTuple, Optional
+
+BRACKETS_RE = re.compile(r"[\(\)\[\]\{\}]")
+NON_WORD_RE = re.compile(r"[^a-яa-z0-9 ]+")
+SPACES_RE = re.compile(r"\s+")
+
+
+class CompiledRule(NamedTuple):
+    config_index: int
+    chats: Optional[frozenset[int]]
+    excluded_senders: frozenset[int]
+    keywords: tuple[str, ...]
+    excluded_keywords: tuple[str, ...]
+    include_questions: bool
+
+
+class RuleMatch(NamedTuple):
+    config_index: int
+    # Сработало по ключевому слову/вопросу, но есть слово-исключение
+    blocked: bool
+
+
+# chat_id, sender_id, raw_text
+MessageInput = tuple[int, int, str]
+# normalized text, сработавшие правила
+MatchResult = tuple[str, list[RuleMatch]]
+
+# Копия правил в процессе-воркере, заполняется init_worker
+worker_rules: list[CompiledRule] = []
+
+
+def normalize_text(text: str) -> str:
+    text = text.lower().strip()
+    text = BRACKETS_RE.sub("", text)
+    text = NON_WORD_RE.sub("", text)
+    text = SPACES_RE.sub(" ", text)
+    return text
+
+
+def compile_words(words: Any) -> tuple[str, ...]:
+    # Поиск подстрок через `in` быстрее одной большой regex-альтернации
+    return tuple(words) if isinstance(words, list) else ()
+
+
+def compile_rules(configs: list[dict[str, Any]]) -> list[CompiledRule]:
+    rules = []
+
+    for index, config in enumerate(configs):
+        chats = config.get("chats", set())
+        excluded_senders = config.get("excluded_senders", [])
+
+        rules.append(
+            CompiledRule(
+                config_index=index,
+                chats=frozenset(chats) if isinstance(chats, set) else None,
+                excluded_senders=(
+                    frozenset(excluded_senders) if isinstance(excluded_senders, list) else frozenset()
+                ),
+                keywords=compile_words(config.get("keywords", [])),
+                excluded_keywords=compile_words(config.get("excluded_keywords", [])),
+                include_questions=bool(config.get("include_questions")),
+            )
+        )
+
+    return rules
+
+
+def evaluate_message(
+    rules: list[CompiledRule],
+    chat_id: int,
+    sender_id: int,
+    raw_text: str,
+) -> MatchResult:
+    text = normalize_text(raw_text)
+    is_question = "?" in raw_text
+    matches = []
+
+    for rule in rules:
+        if rule.chats is not None and chat_id not in rule.chats:
+            continue
+
+        if sender_id in rule.excluded_senders:
+            continue
+
+        matched = any(word in text for word in rule.keywords)
+
+        if not (matched or (rule.include_questions and is_question)):
+            continue
+
+        blocked = any(word in text for word in rule.excluded_keywords)
+        matches.append(RuleMatch(rule.config_index, blocked))
+
+    return text, matches
+
+
+def init_worker(configs: list[dict[str, Any]]) -> None:
+    global worker_rules
+    worker_rules = compile_rules(configs)
+
+
+def evaluate_batch(batch: list[MessageInput]) -> list[MatchResult]:
+    return [evaluate_message(worker_rules, *item) for item in batch]
+
+
+def warm_up() -> None:
+    pass
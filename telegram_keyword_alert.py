@@ -1,36 +1,76 @@
 import asyncio
+import bisect
+import multiprocessing
+import hashlib
+import json
 import logging
 import os
-import re
 import random
+import signal
+import weakref
+import sys
+import threading
+import time
+import traceback
 import seqlog
 import openai
 import numpy as np
 
-from telethon import TelegramClient, events
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from telethon import TelegramClient, events, utils
 from telethon.errors import PeerFloodError
+from telethon.tl.types import InputPeerChannel, InputPeerUser, PeerChannel, PeerUser
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from collections import defaultdict
 from zoneinfo import ZoneInfo
-from typing import Optional
+from typing import Any, Coroutine, Optional
+
+import matcher
+from matcher import MatchResult, MessageInput
 
 user_message_cache: dict[int, list[tuple[str, datetime]]] = defaultdict(list)
 last_sent: dict[int, datetime] = {}
 chat_title_cache: dict[int, str] = {}
 chat_username_cache: dict[int, str] = {}
+chat_resolved_at: dict[int, datetime] = {}
 poll_last_seen: dict[int, int] = {}
-notification_target_cache: dict[int, int] = {}
+# notification_msg_id -> (user_id, сессия, которая видела пользователя)
+notification_target_cache: dict[int, tuple[int, str]] = {}
+ready_chat_ids: set[int] = set()
+chat_input_peers: dict[int, InputPeerChannel | InputPeerUser] = {}
+session_user_ids: dict[str, int] = {}
+last_poll_success: dict[int, datetime] = {}
+poller_progress: dict[str, datetime] = {}
+poll_tasks: dict[str, asyncio.Task] = {}
+# session -> (время, "restart" | "reconnect")
+watchdog_last_action: dict[str, tuple[datetime, str]] = {}
+# Событие выставляется, когда переподключение по watchdog закончено
+reconnect_done: dict[str, asyncio.Event] = {}
 
 cache_lock = asyncio.Lock()
+# Замок живёт, пока его держит хотя бы одна обработка сообщения
+sender_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
 last_sent_lock = asyncio.Lock()
 metrics_lock = asyncio.Lock()
 notification_target_lock = asyncio.Lock()
 poll_lock = asyncio.Lock()
 
+background_tasks: set[asyncio.Task] = set()
+drain_tasks: set[asyncio.Task] = set()
+shutdown_event = asyncio.Event()
+stall_watch_stop = threading.Event()
+
 
 class State:
     last_handler_start: Optional[datetime] = None
+    loop_tick: float = 0.0
+    lag_max: float = 0.0
+    lag_total: float = 0.0
+    lag_count: int = 0
+    last_lag_dump: float = 0.0
+    lag_monitor_running: bool = False
 
 
 state = State()
@@ -45,6 +85,17 @@ api_id = int(api_id_str)
 api_hash = os.getenv("API_HASH")
 session_name = "keyword_alert_notification"
 
+# Несколько аккаунтов в одном процессе: чаты распределяются между сессиями
+# консистентным хешированием, уведомления отправляются через SENDER_SESSION.
+SESSION_NAMES = [
+    name.strip() for name in os.getenv("SESSION_NAMES", session_name).split(",") if name.strip()
+]
+SENDER_SESSION = os.getenv("SENDER_SESSION", SESSION_NAMES[0])
+if SENDER_SESSION not in SESSION_NAMES:
+    raise ValueError(f"SENDER_SESSION {SENDER_SESSION} is not in SESSION_NAMES")
+
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "100"))
+
 openai.api_key = os.getenv("OPENAI_API_KEY")
 openAIclient = openai.AsyncOpenAI()
 
@@ -60,6 +111,27 @@ SEQ_URL = os.getenv("SEQ_URL")
 POLL_INTERVAL_SECONDS = int(os.getenv("POLL_INTERVAL_SECONDS", "10"))
 POLL_LIMIT = int(os.getenv("POLL_LIMIT", "50"))
 
+STARTUP_CONCURRENCY = int(os.getenv("STARTUP_CONCURRENCY", "5"))
+CHAT_CACHE_PATH = os.getenv("CHAT_CACHE_PATH", os.path.join(BASE_DIR, "chat_cache.json"))
+CHAT_CACHE_TTL_SECONDS = int(os.getenv("CHAT_CACHE_TTL_SECONDS", "86400"))
+
+SHUTDOWN_TIMEOUT_SECONDS = int(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", "20"))
+STATE_PATH = os.getenv("STATE_PATH", os.path.join(BASE_DIR, "bot_state.json"))
+STATE_MAX_AGE_SECONDS = int(os.getenv("STATE_MAX_AGE_SECONDS", "600"))
+
+# 0 — правила проверяются в event loop; N > 0 — в N процессах-воркерах
+MATCHER_PROCESSES = int(os.getenv("MATCHER_PROCESSES", "0"))
+MATCHER_BATCH_SIZE = int(os.getenv("MATCHER_BATCH_SIZE", "50"))
+
+HEARTBEAT_INTERVAL_SECONDS = 60
+HEARTBEAT_TIMEOUT_SECONDS = int(os.getenv("HEARTBEAT_TIMEOUT_SECONDS", "30"))
+LAG_SAMPLE_SECONDS = float(os.getenv("LAG_SAMPLE_SECONDS", "0.1"))
+LAG_DUMP_THRESHOLD_SECONDS = float(os.getenv("LAG_DUMP_THRESHOLD_SECONDS", "1.0"))
+LAG_DUMP_COOLDOWN_SECONDS = int(os.getenv("LAG_DUMP_COOLDOWN_SECONDS", "300"))
+POLL_STALL_SECONDS = int(
+    os.getenv("POLL_STALL_SECONDS", str(max(120, POLL_INTERVAL_SECONDS * 6)))
+)
+
 if SEQ_URL:
     seqlog.log_to_seq(
         server_url=SEQ_URL,
@@ -76,6 +148,7 @@ else:
 
 CONFIGS = [
     {
+        "name": "трансфер",
         "chats": {-1001954706166, -1001676333024, -1001214960694, -1001850398389},
         "keywords": [
             "ищу",
@@ -163,6 +236,7 @@ CONFIGS = [
         "include_questions": True,
     },
     {
+        "name": "без ключевых слов",
         "chats": {
             # -1001211521747,
             # -1001609324023,
@@ -180,24 +254,53 @@ CONFIGS = [
 
 PERIOD_MINUTES = 5
 
-client = TelegramClient(
-    session_name,
-    api_id,
-    api_hash,
-    auto_reconnect=True,
-    connection_retries=-1,
-    retry_delay=2,
-    sequential_updates=False,
-    catch_up=False,
-)
+compiled_rules = matcher.compile_rules(CONFIGS)
+matcher_pool: Optional[ProcessPoolExecutor] = None
+
+
+def create_client(name: str) -> TelegramClient:
+    return TelegramClient(
+        name,
+        api_id,
+        api_hash,
+        auto_reconnect=True,
+        connection_retries=-1,
+        retry_delay=2,
+        sequential_updates=False,
+        catch_up=False,
+    )
+
+
+clients: dict[str, TelegramClient] = {name: create_client(name) for name in SESSION_NAMES}
+client = clients[SENDER_SESSION]
+
+
+def shard_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def build_shard_ring(names: list[str]) -> list[tuple[int, str]]:
+    return sorted(
+        (shard_hash(f"{name}#{i}"), name) for name in names for i in range(SHARD_VIRTUAL_NODES)
+    )
+
+
+shard_ring = build_shard_ring(SESSION_NAMES)
+shard_ring_keys = [h for h, _ in shard_ring]
+
+
+def get_chat_shard(chat_id: int) -> str:
+    idx = bisect.bisect(shard_ring_keys, shard_hash(str(chat_id))) % len(shard_ring)
+    return shard_ring[idx][1]
 
 
-def normalize_text(text: str) -> str:
-    text = text.lower().strip()
-    text = re.sub(r"[\(\)\[\]\{\}]", "", text)
-    text = re.sub(r"[^a-яa-z0-9 ]+", "", text)
-    text = re.sub(r"\s+", " ", text)
-    return text
+def get_chat_client(chat_id: int) -> TelegramClient:
+    return clients[get_chat_shard(chat_id)]
+
+
+def get_chat_peer(chat_id: int) -> int | InputPeerChannel | InputPeerUser:
+    # Готовый peer из кэша chats.py позволяет не резолвить чат через сеть
+    return chat_input_peers.get(chat_id, chat_id)
 
 
 def getnow() -> datetime:
@@ -209,6 +312,14 @@ async def get_recent_messages(user_id: int) -> list[tuple[str, datetime]]:
         return list(user_message_cache[user_id])
 
 
+def get_sender_lock(user_id: int) -> asyncio.Lock:
+    lock = sender_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        sender_locks[user_id] = lock
+    return lock
+
+
 async def add_to_user_cache(user_id: int, normalized_text: str) -> None:
     async with cache_lock:
         user_message_cache[user_id].append((normalized_text, getnow()))
@@ -245,7 +356,12 @@ async def is_semantically_duplicate(user_id: int, text: str) -> bool:
     return False
 
 
-async def send_message_safe(recipient: int, message: str, target_user_id: int) -> bool:
+async def send_message_safe(
+    recipient: int,
+    message: str,
+    target_user_id: int,
+    target_session: str,
+) -> bool:
     started_at = getnow()
 
     async with last_sent_lock:
@@ -267,7 +383,7 @@ async def send_message_safe(recipient: int, message: str, target_user_id: int) -
         sent_msg = await client.send_message(recipient, message, parse_mode="markdown")
 
         async with notification_target_lock:
-            notification_target_cache[sent_msg.id] = target_user_id
+            notification_target_cache[sent_msg.id] = (target_user_id, target_session)
 
         logging.info(
             "send_message_safe: sent to %s in %.3fs notification_msg_id=%s target_user_id=%s",
@@ -305,12 +421,16 @@ async def handle_transfer_offer(
         return
 
     async with notification_target_lock:
-        target_user_id = notification_target_cache.get(reply_msg.id)
+        target = notification_target_cache.get(reply_msg.id)
 
-    if target_user_id is None:
+    if target is None:
         await event.reply("Не нашёл пользователя для этого уведомления.")
         return
 
+    # Пользователя знает только сессия, опрашивающая его чат, поэтому пишем через неё
+    target_user_id, target_session = target
+    target_client = clients[target_session]
+
     if not rest:
         await event.reply("Добавьте описание: например `предложи попутку Бар — Будва`")
         return
@@ -322,14 +442,14 @@ async def handle_transfer_offer(
     try:
         if is_carpool:
             caption = f"Здравствуйте. Могу предложить вам попутный трансфер {rest}."
-            await client.send_message(target_user_id, caption)
+            await target_client.send_message(target_user_id, caption)
         else:
             caption = (
                 f"Здравствуйте. Могу предложить трансфер {rest}. "
                 f"Машина 2019 года, кондиционер, багажник 400 литров, хетчбек. "
                 f"В салоне не курят. Включаю музыку по запросу, работает CarPlay."
             )
-            await client.send_file(target_user_id, TRANSFER_IMAGE_PATH, caption=caption)
+            await target_client.send_file(target_user_id, TRANSFER_IMAGE_PATH, caption=caption)
 
         await event.reply("Отправлено")
 
@@ -344,15 +464,39 @@ def log_task_exception(task: asyncio.Task) -> None:
     except asyncio.CancelledError:
         pass
     except Exception:
-        logging.exception("Unhandled exception in process_event task")
+        logging.exception("Unhandled exception in %s task", task.get_name())
+
+
+def spawn(coro: Coroutine[Any, Any, None], name: str, drain: bool = False) -> asyncio.Task:
+    # Все фоновые задачи отслеживаются; drain-задачи при остановке
+    # дорабатывают до SHUTDOWN_TIMEOUT_SECONDS, остальные отменяются сразу.
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    task.add_done_callback(log_task_exception)
+
+    if drain:
+        drain_tasks.add(task)
+        task.add_done_callback(drain_tasks.discard)
+
+    return task
+
+
+async def sleep_unless_shutdown(seconds: float) -> None:
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
 
 
 @client.on(events.NewMessage)
 async def handler(event: events.NewMessage.Event) -> None:
     # NewMessage оставляем только для reply-команд:
     # "предложи трансфер", "предложи попутку"
-    task = asyncio.create_task(process_command_event_safe(event))
-    task.add_done_callback(log_task_exception)
+    if shutdown_event.is_set():
+        return
+
+    spawn(process_command_event_safe(event), "process_command_event", drain=True)
 
 
 async def process_command_event_safe(event: events.NewMessage.Event) -> None:
@@ -399,110 +543,204 @@ def get_all_chat_ids() -> set[int]:
     return chat_ids
 
 
-async def initialize_poll_last_seen() -> None:
-    chat_ids = get_all_chat_ids()
-
-    for chat_id in chat_ids:
-        try:
-            messages = await client.get_messages(chat_id, limit=1)
+async def initialize_chat_last_seen(chat_id: int) -> None:
+    if chat_id in poll_last_seen:
+        logging.info(
+            "Polling restored chat_id=%s last_seen_id=%s",
+            chat_id,
+            poll_last_seen[chat_id],
+        )
+        return
 
-            if messages:
-                poll_last_seen[chat_id] = messages[0].id
-                logging.info(
-                    "Polling initialized chat_id=%s last_seen_id=%s",
-                    chat_id,
-                    messages[0].id,
-                )
-            else:
-                poll_last_seen[chat_id] = 0
-                logging.info("Polling initialized chat_id=%s empty", chat_id)
+    try:
+        messages = await get_chat_client(chat_id).get_messages(get_chat_peer(chat_id), limit=1)
 
-        except Exception:
-            logging.exception("Failed to initialize polling for chat_id=%s", chat_id)
+        if messages:
+            poll_last_seen[chat_id] = messages[0].id
+            logging.info(
+                "Polling initialized chat_id=%s last_seen_id=%s",
+                chat_id,
+                messages[0].id,
+            )
+        else:
+            poll_last_seen[chat_id] = 0
+            logging.info("Polling initialized chat_id=%s empty", chat_id)
 
+    except Exception:
+        logging.exception("Failed to initialize polling for chat_id=%s", chat_id)
 
-async def poll_chats() -> None:
-    chat_ids = get_all_chat_ids()
 
+async def poll_chats(shard: str) -> None:
     logging.info(
-        "Polling started. chats=%s interval=%ss limit=%s",
-        len(chat_ids),
+        "Polling started. shard=%s chats=%s interval=%ss limit=%s",
+        shard,
+        sum(1 for chat_id in get_all_chat_ids() if get_chat_shard(chat_id) == shard),
         POLL_INTERVAL_SECONDS,
         POLL_LIMIT,
     )
 
-    while True:
+    poller_progress[shard] = getnow()
+
+    while not shutdown_event.is_set():
         started_at = getnow()
 
-        for chat_id in chat_ids:
+        # Чаты добавляются в ready_chat_ids по мере готовности при старте,
+        # поэтому опрос начинается, не дожидаясь всех остальных.
+        for chat_id in list(ready_chat_ids):
+            if shutdown_event.is_set():
+                break
+
+            if get_chat_shard(chat_id) != shard:
+                continue
+
             try:
                 await poll_chat(chat_id)
+                last_poll_success[chat_id] = getnow()
             except Exception:
                 logging.exception("Polling failed for chat_id=%s", chat_id)
 
+            poller_progress[shard] = getnow()
+
         elapsed = (getnow() - started_at).total_seconds()
 
         logging.info(
-            "Polling iteration finished in %.3fs",
+            "Polling iteration finished shard=%s in %.3fs",
+            shard,
             elapsed,
         )
 
-        await asyncio.sleep(POLL_INTERVAL_SECONDS + random.uniform(0, 2))
+        await sleep_unless_shutdown(POLL_INTERVAL_SECONDS + random.uniform(0, 2))
+        poller_progress[shard] = getnow()
+
+    logging.info("Polling stopped shard=%s", shard)
+
+
+def start_poller(shard: str) -> None:
+    poll_tasks[shard] = spawn(poll_chats(shard), f"poll_chats:{shard}", drain=True)
 
 
 async def poll_chat(chat_id: int) -> None:
     async with poll_lock:
-        last_seen_id = poll_last_seen.get(chat_id, 0)
+        last_seen_id = poll_last_seen.get(chat_id)
+
+    if last_seen_id is None:
+        # Инициализация при старте не удалась: от min_id=0 страницы от старых
+        # к новым прошли бы всю историю чата, поэтому сначала берём watermark.
+        await initialize_chat_last_seen(chat_id)
+
+        if chat_id not in poll_last_seen:
+            raise RuntimeError(f"Polling is not initialized for chat_id={chat_id}")
+        return
 
     newest_seen_id = last_seen_id
-    all_new_messages = []
+    chat_client = get_chat_client(chat_id)
 
+    # reverse=True: страницы от старых к новым, чтобы после рестарта пройти
+    # весь пропуск, а не только последние POLL_LIMIT сообщений.
     while True:
-        messages = await client.get_messages(
-            chat_id,
+        messages = await chat_client.get_messages(
+            get_chat_peer(chat_id),
             min_id=newest_seen_id,
             limit=POLL_LIMIT,
+            reverse=True,
         )
 
         if not messages:
             break
 
-        all_new_messages.extend(messages)
+        messages_sorted = sorted(messages, key=lambda m: m.id)
+        newest_seen_id = messages_sorted[-1].id
 
-        newest_seen_id = max(m.id for m in messages)
+        logging.info(
+            "Polling got %s new messages for chat_id=%s last_seen_id=%s newest_id=%s",
+            len(messages_sorted),
+            chat_id,
+            last_seen_id,
+            newest_seen_id,
+        )
+
+        match_results = await evaluate_messages(
+            [(chat_id, msg.sender_id or 0, (msg.raw_text or "").strip()) for msg in messages_sorted]
+        )
+
+        for msg, match_result in zip(messages_sorted, match_results):
+            await process_message_data(
+                source="poll",
+                chat_id=chat_id,
+                message_id=msg.id,
+                sender_id=msg.sender_id,
+                raw_text=msg.raw_text or "",
+                message_date=msg.date,
+                message_obj=msg,
+                match_result=match_result,
+            )
+
+            # Watermark двигается после каждого сообщения, чтобы прерванный
+            # при остановке опрос не отправил уведомления повторно.
+            async with poll_lock:
+                poll_last_seen[chat_id] = max(poll_last_seen.get(chat_id, 0), msg.id)
 
         if len(messages) < POLL_LIMIT:
             break
 
-    if not all_new_messages:
+
+def start_matcher_pool() -> None:
+    global matcher_pool
+
+    if MATCHER_PROCESSES <= 0:
         return
 
-    messages_sorted = sorted(all_new_messages, key=lambda m: m.id)
+    # fork: воркеру не нужно заново импортировать бота с клиентами Telegram
+    matcher_pool = ProcessPoolExecutor(
+        max_workers=MATCHER_PROCESSES,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=matcher.init_worker,
+        initargs=(CONFIGS,),
+    )
+
+    # Процессы создаются при первой задаче — запускаем их сразу, до подключения клиентов
+    for _ in range(MATCHER_PROCESSES):
+        matcher_pool.submit(matcher.warm_up)
 
     logging.info(
-        "Polling got %s new messages for chat_id=%s last_seen_id=%s newest_id=%s",
-        len(messages_sorted),
-        chat_id,
-        last_seen_id,
-        messages_sorted[-1].id,
+        "Matcher pool started processes=%s batch_size=%s",
+        MATCHER_PROCESSES,
+        MATCHER_BATCH_SIZE,
     )
 
-    for msg in messages_sorted:
-        await process_message_data(
-            source="poll",
-            chat_id=chat_id,
-            message_id=msg.id,
-            sender_id=msg.sender_id,
-            raw_text=msg.raw_text or "",
-            message_date=msg.date,
-            message_obj=msg,
-        )
 
-    async with poll_lock:
-        poll_last_seen[chat_id] = max(
-            poll_last_seen.get(chat_id, 0),
-            messages_sorted[-1].id,
+def stop_matcher_pool() -> None:
+    if matcher_pool is not None:
+        matcher_pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def evaluate_messages(batch: list[MessageInput]) -> list[MatchResult]:
+    if matcher_pool is None or not batch:
+        return [matcher.evaluate_message(compiled_rules, *item) for item in batch]
+
+    loop = asyncio.get_running_loop()
+    batch_size = max(1, MATCHER_BATCH_SIZE)
+    chunks = [batch[i:i + batch_size] for i in range(0, len(batch), batch_size)]
+
+    pool = matcher_pool
+
+    try:
+        chunk_results = await asyncio.gather(
+            *(loop.run_in_executor(pool, matcher.evaluate_batch, chunk) for chunk in chunks)
         )
+    except BrokenProcessPool:
+        # Воркер умер (OOM, segfault) — пул больше не принимает задачи.
+        # Пересоздаём его, а текущую пачку проверяем в event loop.
+        logging.exception("Matcher pool is broken, restarting it")
+
+        # Несколько опросов могут упасть одновременно — пересоздаём пул один раз
+        if matcher_pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            start_matcher_pool()
+
+        return [matcher.evaluate_message(compiled_rules, *item) for item in batch]
+
+    return [result for chunk_result in chunk_results for result in chunk_result]
 
 
 async def process_message_data(
@@ -513,6 +751,7 @@ async def process_message_data(
     raw_text: str,
     message_date: datetime,
     message_obj: object | None = None,
+    match_result: Optional[MatchResult] = None,
 ) -> None:
     started_at = getnow()
 
@@ -545,104 +784,164 @@ async def process_message_data(
     if not raw_text:
         return
 
-    text = normalize_text(raw_text)
-    recent_messages = await get_recent_messages(sender_id)
+    if match_result is None:
+        match_result = matcher.evaluate_message(compiled_rules, chat_id, sender_id, raw_text)
 
-    for config in CONFIGS:
-        chats = config.get("chats", set())
-        if isinstance(chats, set) and chat_id not in chats:
-            continue
+    text, rule_matches = match_result
 
-        excluded_senders = config.get("excluded_senders", [])
-        if isinstance(excluded_senders, list) and sender_id in excluded_senders:
-            continue
+    # Сообщения одного пользователя обрабатываются по очереди: иначе кросспост
+    # в чаты разных шардов проходит проверку is_repeat в обоих до add_to_user_cache.
+    async with get_sender_lock(sender_id):
+        recent_messages = await get_recent_messages(sender_id)
+        ctx = MessageContext(
+            chat_id, message_id, sender_id, raw_text, text, msg_time_local, message_obj, recent_messages
+        )
 
-        if any(prev_text == text for prev_text, _ in recent_messages):
-            logging.info("⛔ Повтор от пользователя %s: %s", sender_id, text)
-            continue
+        # recipient -> индексы сработавших правил; одно уведомление на получателя
+        matches: dict[int, list[int]] = defaultdict(list)
+        matched_any = False
 
-        keywords = config.get("keywords", [])
-        matched = any(word in text for word in keywords) if isinstance(keywords, list) else False
+        # Правила без состояния уже проверены в matcher; здесь — проверки по кэшу пользователя
+        for index, blocked in rule_matches:
+            config = CONFIGS[index]
 
-        is_question = "?" in raw_text
-        include_questions = bool(config.get("include_questions"))
+            if ctx.is_repeat:
+                logging.info("⛔ Повтор от пользователя %s: %s", sender_id, text)
+                continue
 
-        if not (matched or (include_questions and is_question)):
-            continue
+            if blocked:
+                logging.info("⛔ Игнор по слову для пользователя %s: %s", sender_id, text)
+                continue
 
-        excluded_keywords = config.get("excluded_keywords", [])
-        if isinstance(excluded_keywords, list) and any(
-            block_word in text for block_word in excluded_keywords
-        ):
-            logging.info("⛔ Игнор по слову для пользователя %s: %s", sender_id, text)
-            continue
+            if ctx.is_recent:
+                logging.info(
+                    "⏱️ Игнор: пользователь %s уже писал за последние %s минут",
+                    sender_id,
+                    PERIOD_MINUTES,
+                )
+                continue
 
-        now = getnow()
-        if any((now - ts) < timedelta(minutes=PERIOD_MINUTES) for _, ts in recent_messages):
-            logging.info(
-                "⏱️ Игнор: пользователь %s уже писал за последние %s минут",
-                sender_id,
-                PERIOD_MINUTES,
-            )
-            continue
+            if ENABLE_SEMANTIC_FILTER and await ctx.is_semantic_duplicate():
+                logging.info("⛔ Игнор: пользователь %s уже писал об этом", sender_id)
+                continue
 
-        if ENABLE_SEMANTIC_FILTER and await is_semantically_duplicate(sender_id, text):
-            logging.info("⛔ Игнор: пользователь %s уже писал об этом", sender_id)
-            continue
+            matched_any = True
 
-        chat_title = chat_title_cache.get(chat_id, str(chat_id))
-        chat_username = chat_username_cache.get(chat_id)
+            recipient = config.get("recipient")
+            if isinstance(recipient, int):
+                matches[recipient].append(index)
 
-        sender_name, is_bot = await get_sender_info(sender_id, message_obj)
+        if not matched_any:
+            return
+
+        _, is_bot = await ctx.get_sender()
         if is_bot:
             logging.info("🤖 Игнор сообщения от бота sender_id=%s", sender_id)
             return
 
-        sender_link = f"[{sender_name}](tg://user?id={sender_id})"
-
-        message_link = None
-        if chat_username:
-            message_link = f"https://t.me/{chat_username}/{message_id}"
-
         logging.info(
             "[🔔] Chat: %s | SenderId: %s | Msg: %s",
-            chat_title,
+            ctx.chat_title,
             sender_id,
             raw_text,
         )
 
-        if message_link:
-            message = (
-                f"[Сообщение]({message_link}) в чате \"{chat_title}\" от {sender_link} "
-                f"в {msg_time_local.strftime('%H:%M:%S')}:\n\n"
-                f"{raw_text}"
-            )
-        else:
-            message = (
-                f"Сообщение в чате \"{chat_title}\" от {sender_link} "
-                f"в {msg_time_local.strftime('%H:%M:%S')}:\n\n"
-                f"{raw_text}"
-            )
+        for recipient, rule_indexes in matches.items():
+            rule_names = [CONFIGS[index].get("name") or f"#{index + 1}" for index in rule_indexes]
+
+            message = await ctx.format_body()
+            # Одно безымянное правило — строка «Правила: #1» ничего не говорит
+            if len(rule_indexes) > 1 or CONFIGS[rule_indexes[0]].get("name"):
+                message = f"{message}\n\nПравила: {', '.join(map(str, rule_names))}"
 
-        recipient = config.get("recipient")
-        if isinstance(recipient, int):
-            sent = await send_message_safe(recipient, message, sender_id)
+            sent = await send_message_safe(recipient, message, sender_id, get_chat_shard(chat_id))
 
             if sent:
                 logging.info(
-                    "Message sent | SenderId: %s | Recipient: %s",
+                    "Message sent | SenderId: %s | Recipient: %s | Rules: %s",
                     sender_id,
                     recipient,
+                    rule_names,
                 )
 
         await add_to_user_cache(sender_id, text)
 
-        logging.info(
-            "MSG END source=%s total=%.3fs",
-            source,
-            (getnow() - started_at).total_seconds(),
+    logging.info(
+        "MSG END source=%s total=%.3fs",
+        source,
+        (getnow() - started_at).total_seconds(),
+    )
+
+
+class MessageContext:
+    """Данные сообщения, общие для всех конфигов; считаются один раз и лениво."""
+
+    def __init__(
+        self,
+        chat_id: int,
+        message_id: int,
+        sender_id: int,
+        raw_text: str,
+        text: str,
+        msg_time_local: datetime,
+        message_obj: object | None,
+        recent_messages: list[tuple[str, datetime]],
+    ) -> None:
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.sender_id = sender_id
+        self.raw_text = raw_text
+        self.msg_time_local = msg_time_local
+        self.message_obj = message_obj
+        self.text = text
+        self.chat_title = chat_title_cache.get(chat_id, str(chat_id))
+
+        now = getnow()
+        self.is_repeat = any(prev_text == text for prev_text, _ in recent_messages)
+        self.is_recent = any(
+            (now - ts) < timedelta(minutes=PERIOD_MINUTES) for _, ts in recent_messages
         )
 
+        self.sender_name: Optional[str] = None
+        self.is_bot = False
+
+        self._is_semantic_duplicate: Optional[bool] = None
+        self._body: Optional[str] = None
+
+    async def is_semantic_duplicate(self) -> bool:
+        if self._is_semantic_duplicate is None:
+            self._is_semantic_duplicate = await is_semantically_duplicate(
+                self.sender_id, self.text
+            )
+        return self._is_semantic_duplicate
+
+    async def get_sender(self) -> tuple[str, bool]:
+        if self.sender_name is None:
+            self.sender_name, self.is_bot = await get_sender_info(self.sender_id, self.message_obj)
+        return self.sender_name, self.is_bot
+
+    async def format_body(self) -> str:
+        if self._body is None:
+            sender_name, _ = await self.get_sender()
+            sender_link = f"[{sender_name}](tg://user?id={self.sender_id})"
+            chat_username = chat_username_cache.get(self.chat_id)
+            sent_at = self.msg_time_local.strftime("%H:%M:%S")
+
+            if chat_username:
+                message_link = f"https://t.me/{chat_username}/{self.message_id}"
+                self._body = (
+                    f"[Сообщение]({message_link}) в чате \"{self.chat_title}\" от {sender_link} "
+                    f"в {sent_at}:\n\n"
+                    f"{self.raw_text}"
+                )
+            else:
+                self._body = (
+                    f"Сообщение в чате \"{self.chat_title}\" от {sender_link} "
+                    f"в {sent_at}:\n\n"
+                    f"{self.raw_text}"
+                )
+        return self._body
+
 
 async def get_sender_info(sender_id: int, message_obj: object | None) -> tuple[str, bool]:
     sender_name = f"user_{sender_id}"
@@ -670,61 +969,392 @@ async def get_sender_info(sender_id: int, message_obj: object | None) -> tuple[s
     return sender_name, is_bot
 
 
-async def preload_chats() -> None:
-    chat_ids: set[int] = set()
+def read_chat_cache() -> dict:
+    with open(CHAT_CACHE_PATH, encoding="utf-8") as f:
+        return json.load(f)
 
-    for cfg in CONFIGS:
-        chats = cfg.get("chats", set())
-        if isinstance(chats, set):
-            chat_ids.update(chats)
 
-    for chat_id in chat_ids:
+def make_input_peer(chat_id: int, access_hash: int) -> Optional[InputPeerChannel | InputPeerUser]:
+    real_id, peer_type = utils.resolve_id(chat_id)
+
+    if peer_type is PeerChannel:
+        return InputPeerChannel(real_id, access_hash)
+    if peer_type is PeerUser:
+        return InputPeerUser(real_id, access_hash)
+
+    return None
+
+
+def load_chat_cache() -> set[int]:
+    try:
+        data = read_chat_cache()
+    except FileNotFoundError:
+        return set()
+    except Exception:
+        logging.exception("Failed to load chat cache from %s", CHAT_CACHE_PATH)
+        return set()
+
+    # access_hash действителен только для аккаунта, который делал выгрузку
+    account_id = data.get("account_id")
+    loaded: set[int] = set()
+    peers = 0
+
+    for key, item in data.get("chats", {}).items():
         try:
-            entity = await client.get_entity(chat_id)
+            chat_id = int(key)
+        except ValueError:
+            continue
+
+        title = item.get("title")
+        if not title:
+            continue
 
-            title = getattr(entity, "title", str(chat_id))
-            username = getattr(entity, "username", None)
+        chat_title_cache[chat_id] = title
 
-            chat_title_cache[chat_id] = title
+        username = item.get("username")
+        if username:
+            chat_username_cache[chat_id] = username
 
-            if username:
-                chat_username_cache[chat_id] = username
+        resolved_at = item.get("resolved_at")
+        if resolved_at:
+            try:
+                chat_resolved_at[chat_id] = datetime.fromisoformat(resolved_at)
+            except ValueError:
+                pass
 
-            logging.info(
-                "Preloaded chat %s title=%s username=%s",
-                chat_id,
-                title,
-                username,
-            )
+        access_hash = item.get("access_hash")
+        if (
+            access_hash is not None
+            and account_id is not None
+            and session_user_ids.get(get_chat_shard(chat_id)) == account_id
+        ):
+            peer = make_input_peer(chat_id, access_hash)
+            if peer is not None:
+                chat_input_peers[chat_id] = peer
+                peers += 1
 
-        except Exception:
-            logging.exception("Failed to preload chat %s", chat_id)
+        loaded.add(chat_id)
+
+    logging.info(
+        "Loaded chat cache from %s chats=%s peers=%s",
+        CHAT_CACHE_PATH,
+        len(loaded),
+        peers,
+    )
+    return loaded
+
+
+def save_chat_cache() -> None:
+    try:
+        data = read_chat_cache()
+    except FileNotFoundError:
+        data = {}
+    except Exception:
+        logging.exception("Failed to read chat cache from %s", CHAT_CACHE_PATH)
+        data = {}
+
+    # Поля из выгрузки chats.py (access_hash, type) сохраняются
+    chats = data.setdefault("chats", {})
+    for chat_id, title in chat_title_cache.items():
+        item = chats.setdefault(str(chat_id), {})
+        item["title"] = title
+        item["username"] = chat_username_cache.get(chat_id)
+
+        resolved_at = chat_resolved_at.get(chat_id)
+        if resolved_at is not None:
+            item["resolved_at"] = resolved_at.isoformat()
+
+    tmp_path = f"{CHAT_CACHE_PATH}.tmp"
+
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, CHAT_CACHE_PATH)
+    except Exception:
+        logging.exception("Failed to save chat cache to %s", CHAT_CACHE_PATH)
+
+
+def load_state() -> None:
+    try:
+        with open(STATE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        saved_at = datetime.fromisoformat(data["saved_at"])
+    except FileNotFoundError:
+        return
+    except Exception:
+        logging.exception("Failed to load state from %s", STATE_PATH)
+        return
+
+    # Состояние годится только для одного старта: после жёсткого убийства
+    # процесса старые watermark'и не должны загрузиться повторно.
+    try:
+        os.remove(STATE_PATH)
+    except OSError:
+        logging.exception("Failed to remove state file %s, ignoring it", STATE_PATH)
+        return
+
+    now = getnow()
+    age = (now - saved_at).total_seconds()
+
+    # После долгого простоя догонять старые сообщения не нужно
+    if age > STATE_MAX_AGE_SECONDS:
+        logging.info("State in %s is too old (%.0fs), ignoring", STATE_PATH, age)
+        return
+
+    chat_ids = get_all_chat_ids()
+    for key, last_seen_id in data.get("poll_last_seen", {}).items():
+        if int(key) in chat_ids:
+            poll_last_seen[int(key)] = last_seen_id
+
+    # Кэш пользователей очищается в полночь, поэтому переносим его только в пределах дня
+    if saved_at.date() == now.date():
+        for key, items in data.get("user_message_cache", {}).items():
+            user_message_cache[int(key)] = [
+                (text, datetime.fromisoformat(ts)) for text, ts in items
+            ]
+
+    logging.info(
+        "Loaded state from %s age=%.0fs chats=%s users=%s",
+        STATE_PATH,
+        age,
+        len(poll_last_seen),
+        len(user_message_cache),
+    )
+
+
+def save_state() -> None:
+    data = {
+        "saved_at": getnow().isoformat(),
+        "poll_last_seen": {str(k): v for k, v in poll_last_seen.items()},
+        "user_message_cache": {
+            str(k): [(text, ts.isoformat()) for text, ts in items]
+            for k, items in user_message_cache.items()
+        },
+    }
+
+    tmp_path = f"{STATE_PATH}.tmp"
+
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, STATE_PATH)
+        logging.info("Saved state to %s chats=%s", STATE_PATH, len(poll_last_seen))
+    except Exception:
+        logging.exception("Failed to save state to %s", STATE_PATH)
+
+
+async def preload_chat(chat_id: int) -> bool:
+    try:
+        entity = await get_chat_client(chat_id).get_entity(get_chat_peer(chat_id))
+
+        title = getattr(entity, "title", str(chat_id))
+        username = getattr(entity, "username", None)
+
+        chat_title_cache[chat_id] = title
+
+        if username:
+            chat_username_cache[chat_id] = username
+        else:
+            chat_username_cache.pop(chat_id, None)
+
+        chat_resolved_at[chat_id] = getnow()
+
+        logging.info(
+            "Preloaded chat %s title=%s username=%s",
+            chat_id,
+            title,
+            username,
+        )
+        return True
+
+    except Exception:
+        logging.exception("Failed to preload chat %s", chat_id)
+        return False
+
+
+async def prepare_chat(
+    chat_id: int,
+    cached_chat_ids: set[int],
+    semaphore: asyncio.Semaphore,
+    started_at: datetime,
+) -> bool:
+    resolved = False
+
+    async with semaphore:
+        if chat_id not in cached_chat_ids:
+            resolved = await preload_chat(chat_id)
+
+        await initialize_chat_last_seen(chat_id)
+
+    # Как и раньше, чат опрашивается даже если инициализация не удалась.
+    ready_chat_ids.add(chat_id)
+    # Возраст последнего опроса считаем с момента готовности чата
+    last_poll_success.setdefault(chat_id, getnow())
+
+    logging.info(
+        "Chat ready chat_id=%s cached=%s after %.3fs",
+        chat_id,
+        chat_id in cached_chat_ids,
+        (getnow() - started_at).total_seconds(),
+    )
+    return resolved
+
+
+async def prepare_chats() -> None:
+    started_at = getnow()
+
+    chat_ids = get_all_chat_ids()
+    cached_chat_ids = load_chat_cache() & chat_ids
+    semaphore = asyncio.Semaphore(max(1, STARTUP_CONCURRENCY))
+
+    results = await asyncio.gather(
+        *(prepare_chat(chat_id, cached_chat_ids, semaphore, started_at) for chat_id in chat_ids)
+    )
+
+    if any(results):
+        save_chat_cache()
+
+    logging.info(
+        "STARTUP ready chats=%s cached=%s resolved=%s concurrency=%s time_to_ready=%.3fs",
+        len(chat_ids),
+        len(cached_chat_ids),
+        sum(results),
+        STARTUP_CONCURRENCY,
+        (getnow() - started_at).total_seconds(),
+    )
+
+    now = getnow()
+    expired_chat_ids = {
+        chat_id
+        for chat_id in cached_chat_ids
+        if chat_id not in chat_resolved_at
+        or (now - chat_resolved_at[chat_id]).total_seconds() > CHAT_CACHE_TTL_SECONDS
+    }
+
+    if expired_chat_ids:
+        spawn(refresh_cached_chats(expired_chat_ids, semaphore), "refresh_cached_chats")
+
+
+async def refresh_cached_chats(chat_ids: set[int], semaphore: asyncio.Semaphore) -> None:
+    # Название и username чата могут измениться: записи старше
+    # CHAT_CACHE_TTL_SECONDS обновляем в фоне после готовности.
+    async def refresh(chat_id: int) -> bool:
+        async with semaphore:
+            return await preload_chat(chat_id)
+
+    results = await asyncio.gather(*(refresh(chat_id) for chat_id in chat_ids))
+
+    if any(results):
+        save_chat_cache()
+
+    logging.info("Refreshed cached chats=%s ok=%s", len(chat_ids), sum(results))
 
 
 async def run_bot() -> None:
-    await client.start()
+    for name, shard_client in clients.items():
+        await shard_client.start()
+        logging.info("🧾 Session %s started", name)
+
+    for name, shard_client in clients.items():
+        me = await shard_client.get_me()
+        session_user_ids[name] = me.id
+        logging.info(
+            "🧾 Signed in as %s (bot=%s) session=%s sender=%s",
+            me.first_name,
+            me.bot,
+            name,
+            name == SENDER_SESSION,
+        )
 
-    asyncio.create_task(heartbeat())
+    spawn(heartbeat(), "heartbeat")
+    spawn(monitor_loop_lag(), "monitor_loop_lag")
+    threading.Thread(
+        target=watch_loop_stall,
+        args=(threading.get_ident(),),
+        name="loop_stall_watchdog",
+        daemon=True,
+    ).start()
 
-    await preload_chats()
-    await initialize_poll_last_seen()
+    for name in clients:
+        start_poller(name)
 
-    asyncio.create_task(poll_chats())
+    await prepare_chats()
 
     now = getnow().strftime("%d-%m-%Y %H:%M:%S")
     logging.info("🧾 Bot run at %s", now)
 
-    me = await client.get_me()
-    logging.info("🧾 Signed in as %s (bot=%s)", me.first_name, me.bot)
     logging.info("✅ Bot is running. Waiting for messages...")
 
-    await client.run_until_disconnected()
+    await asyncio.gather(*(keep_client_running(name) for name in clients))
+
+
+async def keep_client_running(name: str) -> None:
+    shard_client = clients[name]
+
+    while True:
+        # Не run_until_disconnected: он сам вызывает disconnect() при выходе
+        # и мог бы отключить клиента, только что переподключённого watchdog'ом.
+        try:
+            await shard_client.disconnected
+        except Exception:
+            logging.exception("Session %s disconnected with error", name)
+
+        if shutdown_event.is_set():
+            return
+
+        done = reconnect_done.get(name)
+        if done is None:
+            return
+
+        # Отключение по команде watchdog — ждём, пока он подключит клиента заново
+        await done.wait()
+
+        if not shard_client.is_connected():
+            return
+
+
+def request_shutdown(sig: signal.Signals) -> None:
+    logging.info("⚠️ %s — shutting down...", sig.name)
+    shutdown_event.set()
 
 
 async def shutdown() -> None:
+    started_at = getnow()
+
+    # Останавливаем приём: опрос и обработчик команд проверяют shutdown_event
+    shutdown_event.set()
+    # monitor_loop_lag сейчас будет отменён — поток не должен принять это за блокировку
+    stall_watch_stop.set()
+
+    pending_drain = {task for task in drain_tasks if not task.done()}
+    drained = 0
+
+    if pending_drain:
+        logging.info("Draining %s tasks, timeout=%ss", len(pending_drain), SHUTDOWN_TIMEOUT_SECONDS)
+        done, pending_drain = await asyncio.wait(pending_drain, timeout=SHUTDOWN_TIMEOUT_SECONDS)
+        drained = len(done)
+
+    remaining = [task for task in background_tasks if not task.done()]
+    for task in remaining:
+        task.cancel()
+    await asyncio.gather(*remaining, return_exceptions=True)
+
+    stop_matcher_pool()
+    save_state()
+    save_chat_cache()
+
+    for shard_client in clients.values():
+        await shard_client.disconnect()
+
     now = getnow().strftime("%d-%m-%Y %H:%M:%S")
-    logging.info("🧾 Bot stopped at %s", now)
-    await client.disconnect()
+    logging.info(
+        "🧾 Bot stopped at %s drained=%s cancelled=%s (not drained=%s) shutdown=%.3fs",
+        now,
+        drained,
+        len(remaining),
+        len(pending_drain),
+        (getnow() - started_at).total_seconds(),
+    )
 
 
 async def clear_cache_at_midnight() -> None:
@@ -753,32 +1383,238 @@ async def clear_cache_at_midnight() -> None:
 
 async def heartbeat() -> None:
     while True:
-        started_at = getnow()
+        log_loop_lag()
 
-        try:
-            me = await client.get_me()
-            elapsed = (getnow() - started_at).total_seconds()
+        # Сессии проверяются параллельно: иначе таймауты get_me складываются
+        # и цикл heartbeat становится длиннее POLL_STALL_SECONDS.
+        await asyncio.gather(*(heartbeat_session(name) for name in clients))
 
-            logging.info(
-                "HEARTBEAT ok user_id=%s elapsed=%.3fs",
-                me.id,
-                elapsed,
+        await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+
+
+async def heartbeat_session(name: str) -> None:
+    started_at = getnow()
+    get_me_ok = False
+
+    try:
+        me = await asyncio.wait_for(clients[name].get_me(), HEARTBEAT_TIMEOUT_SECONDS)
+        elapsed = (getnow() - started_at).total_seconds()
+        get_me_ok = True
+
+        logging.info(
+            "HEARTBEAT ok session=%s user_id=%s elapsed=%.3fs",
+            name,
+            me.id,
+            elapsed,
+        )
+
+    except Exception:
+        logging.exception("HEARTBEAT failed session=%s", name)
+
+    if not shutdown_event.is_set():
+        await check_ingestion(name, get_me_ok)
+
+
+def log_loop_lag() -> None:
+    if state.lag_count == 0:
+        return
+
+    logging.info(
+        "LOOP LAG avg=%.3fs max=%.3fs samples=%s",
+        state.lag_total / state.lag_count,
+        state.lag_max,
+        state.lag_count,
+    )
+
+    state.lag_max = 0.0
+    state.lag_total = 0.0
+    state.lag_count = 0
+
+
+def format_task_dump() -> str:
+    lines = []
+
+    for task in asyncio.all_tasks():
+        lines.append(f"Task {task.get_name()}:")
+        for frame in task.get_stack(limit=5):
+            lines.append(
+                f"  {frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
             )
 
-        except Exception:
-            logging.exception("HEARTBEAT failed")
+    return "\n".join(lines)
 
-        await asyncio.sleep(60)
+
+async def monitor_loop_lag() -> None:
+    loop = asyncio.get_running_loop()
+    state.loop_tick = time.monotonic()
+    state.lag_monitor_running = True
+
+    try:
+        while True:
+            expected = loop.time() + LAG_SAMPLE_SECONDS
+            await asyncio.sleep(LAG_SAMPLE_SECONDS)
+            lag = max(0.0, loop.time() - expected)
+
+            state.loop_tick = time.monotonic()
+            state.lag_max = max(state.lag_max, lag)
+            state.lag_total += lag
+            state.lag_count += 1
+
+            if (
+                lag >= LAG_DUMP_THRESHOLD_SECONDS
+                and state.loop_tick - state.last_lag_dump >= LAG_DUMP_COOLDOWN_SECONDS
+            ):
+                state.last_lag_dump = state.loop_tick
+                logging.warning("LOOP LAG %.3fs, tasks:\n%s", lag, format_task_dump())
+    finally:
+        state.lag_monitor_running = False
+
+
+def watch_loop_stall(loop_thread_id: int) -> None:
+    # Работает в отдельном потоке: пока event loop заблокирован, сам loop
+    # ничего залогировать не может, поэтому стек снимаем отсюда.
+    dumped_tick = 0.0
+
+    while not stall_watch_stop.wait(LAG_SAMPLE_SECONDS):
+        # Без работающего monitor_loop_lag тик не обновляется — это не блокировка loop
+        if not state.lag_monitor_running:
+            continue
+
+        tick = state.loop_tick
+        blocked = time.monotonic() - tick
+
+        if not tick or tick == dumped_tick or blocked < LAG_DUMP_THRESHOLD_SECONDS:
+            continue
+
+        dumped_tick = tick
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+
+        logging.warning("LOOP BLOCKED for %.3fs, loop thread stack:\n%s", blocked, stack)
+
+
+async def check_ingestion(name: str, get_me_ok: bool) -> None:
+    now = getnow()
+
+    last_action_at, last_action = watchdog_last_action.get(name, (None, None))
+    if last_action_at is not None and (now - last_action_at).total_seconds() < POLL_STALL_SECONDS:
+        return
+
+    progress = poller_progress.get(name)
+    progress_age = (now - progress).total_seconds() if progress is not None else -1.0
+
+    poll_ages = {
+        chat_id: (now - last_poll_success[chat_id]).total_seconds()
+        for chat_id in ready_chat_ids
+        if get_chat_shard(chat_id) == name and chat_id in last_poll_success
+    }
+    stale = {chat_id: age for chat_id, age in poll_ages.items() if age > POLL_STALL_SECONDS}
+
+    logging.info(
+        "WATCHDOG session=%s poller_progress_age=%.1fs oldest_poll_age=%.1fs stale_chats=%s",
+        name,
+        progress_age,
+        max(poll_ages.values(), default=0.0),
+        len(stale),
+    )
+
+    if stale:
+        logging.warning("WATCHDOG session=%s stale chats: %s", name, stale)
+
+    task = poll_tasks.get(name)
+    poller_dead = task is None or task.done()
+    poller_stalled = progress_age > POLL_STALL_SECONDS
+    all_stale = bool(poll_ages) and len(stale) == len(poll_ages)
+    # Опрос снова завис вскоре после перезапуска — дело не в нём, а в соединении
+    restart_failed = (
+        last_action == "restart"
+        and last_action_at is not None
+        and (now - last_action_at).total_seconds() < POLL_STALL_SECONDS * 3
+    )
+
+    if (
+        not get_me_ok
+        or (poller_stalled and restart_failed)
+        or (all_stale and not poller_stalled and not poller_dead)
+    ):
+        # get_me не отвечает, перезапуск опроса уже не помог, или опрос крутится,
+        # но ни один чат не опрашивается — соединение полумёртвое
+        watchdog_last_action[name] = (now, "reconnect")
+        logging.warning("WATCHDOG session=%s ingestion stalled, reconnecting", name)
+        await reconnect_client(name)
+
+        # Опрос мог зависнуть на старом соединении
+        if poller_dead or poller_stalled:
+            await restart_poller(name)
+
+    elif poller_dead or poller_stalled:
+        # Цикл опроса упал или завис при живом соединении — перезапускаем только его
+        watchdog_last_action[name] = (now, "restart")
+        logging.warning("WATCHDOG session=%s poller stalled, restarting", name)
+        await restart_poller(name)
+
+
+async def restart_poller(name: str) -> None:
+    task = poll_tasks.get(name)
+
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    start_poller(name)
+
+
+async def reconnect_client(name: str) -> None:
+    shard_client = clients[name]
+    done = asyncio.Event()
+    reconnect_done[name] = done
+
+    try:
+        await shard_client.disconnect()
+        await shard_client.connect()
+        logging.info("WATCHDOG session=%s reconnected", name)
+    except Exception:
+        logging.exception("WATCHDOG session=%s reconnect failed", name)
+    finally:
+        done.set()
 
 
 async def main() -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_shutdown, sig)
+
+    load_state()
+    start_matcher_pool()
+    spawn(clear_cache_at_midnight(), "clear_cache_at_midnight")
+
+    bot_task = asyncio.create_task(run_bot(), name="run_bot")
+    stop_task = asyncio.create_task(shutdown_event.wait(), name="shutdown_event")
+
     try:
-        asyncio.create_task(clear_cache_at_midnight())
-        await run_bot()
-    except (KeyboardInterrupt, SystemExit):
-        logging.info("⚠️ KeyboardInterrupt — shutting down...")
+        await asyncio.wait({bot_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Запомнить до shutdown(): он сам выставляет shutdown_event
+        shutdown_requested = shutdown_event.is_set()
+
         await shutdown()
 
+        bot_task.cancel()
+        stop_task.cancel()
+        await asyncio.gather(bot_task, stop_task, return_exceptions=True)
+
+    if bot_task.cancelled():
+        return
+
+    error = bot_task.exception()
+    if error is not None:
+        # Ненулевой код выхода, чтобы systemd перезапустил бота
+        raise error
+
+    if not shutdown_requested:
+        logging.error("run_bot finished without shutdown request")
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     asyncio.run(main())